@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
 
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, conlist
 from pydantic import BaseSettings
+from contextlib import asynccontextmanager
 from datetime import date, datetime
-from dokuwiki import DokuWiki, DokuWikiError, Dataentry
+import asyncio
+import gzip
+from dokuwiki import DokuWikiError, Dataentry
 from typing import Dict, List
 from typing import Optional
-import ldap
+from xmlrpc.client import Fault, dumps, loads
+from cachetools import TTLCache
+from ldap3 import Connection, Server, ServerPool, NONE, REUSABLE, ROUND_ROBIN, SUBTREE
+from ldap3.core.exceptions import LDAPException, LDAPResponseTimeoutError
+import hashlib
+import httpx
+import orjson
+import redis.asyncio as redis
+import re
+import time
 
 
 class Settings(BaseSettings):
@@ -19,18 +33,117 @@ class Settings(BaseSettings):
     wiki_pw: str
     ldap_server: str = "ldaps://ldapauth2.uni-regensburg.de:636"
     ldap_base_dn: str = "o=uni-regensburg,c=de"
-    ldap_scope: int = ldap.SCOPE_SUBTREE
+    ldap_scope: str = SUBTREE
+    ldap_pool_size: int = 4 # connections kept open per worker
+    ldap_keepalive: int = 240 # seconds; stay below the server's idle timeout
+    redis_url: Optional[str] = None # e.g. redis://localhost:6379, shares fetched items between workers
     groups_with_edit_rights: List[str] = ["mi-staff.mi.sprachlit.uni-regensburg.de", "mi-shk.mi.sprachlit.uni-regensburg.de"] 
 
 
 
 settings = Settings()
-app = FastAPI()
-dw = DokuWiki(settings.wiki_server, settings.wiki_user, settings.wiki_pw, cookieAuth=True)
-l = ldap.initialize(settings.ldap_server)
+XMLRPC_PATH = "/lib/exe/xmlrpc.php"
+FETCH_CONCURRENCY = 4 # parallel wiki requests during cache updates
+MULTICALL_CHUNK = 50 # pages fetched per system.multicall request
+CACHE_SIZE = 2048
+MAX_BATCH_SIZE = 100 # item ids per /items:batch request
+FULL_REFRESH_INTERVAL = 300 # seconds between complete reloads of all items
+CACHE_TTL = 2 * FULL_REFRESH_INTERVAL # entries must outlive the gap between full refreshes
+MISSING_CACHE_SIZE = 4096
+MISSING_CACHE_TTL = 60 # seconds to remember that an item page does not exist
+POLL_INTERVAL = 30 # seconds between checks for changed wiki pages
+FIRST_LOAD_TIMEOUT = 60 # seconds /items waits for the initial cache fill
+_UID_RE = re.compile(rf'{re.escape(settings.wiki_path)}(\d+)', re.ASCII) # item pages, e.g. lab:ausstattung:042
+REDIS_TTL = 600 # seconds a shared item stays in Redis
+USER_CACHE_SIZE = 512
+USER_CACHE_TTL = 60 # group memberships rarely change within a session
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one persistent session per process; DokuWiki keeps us logged in via cookies
+    app.state.http = httpx.AsyncClient(base_url=settings.wiki_server, timeout=10,
+                                       limits=httpx.Limits(max_keepalive_connections=20))
+    try:
+        if not await dw_send(app.state.http, 'dokuwiki.login', settings.wiki_user, settings.wiki_pw):
+            raise DokuWikiError('invalid login or password!')
+        app.state.ldap = None # bound on first use, so LDAP problems cannot block startup
+        app.state.ldap_lock = asyncio.Lock()
+        app.state.redis = redis.from_url(settings.redis_url) if settings.redis_url else None
+        app.state.cache_ready = asyncio.Event() # set once the first poll filled the cache
+        poller = asyncio.create_task(_poll_changes(app))
+        yield
+        poller.cancel()
+        if app.state.ldap is not None:
+            app.state.ldap.unbind()
+        if app.state.redis is not None:
+            await app.state.redis.aclose()
+    finally:
+        await app.state.http.aclose()
+
+def make_ldap_connection(settings: Settings) -> Connection:
+    pool = ServerPool([Server(settings.ldap_server, use_ssl=True, get_info=NONE, connect_timeout=5)],
+                      ROUND_ROBIN, active=3, exhaust=30) # retry 3 cycles, re-check a dead server after 30 s
+    # REUSABLE keeps a pool of bound connections that reconnect on their own
+    return Connection(pool, client_strategy=REUSABLE, auto_bind=True,
+                      pool_size=settings.ldap_pool_size, pool_keepalive=settings.ldap_keepalive)
+
+async def get_wiki(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http
+
+async def get_ldap_connection(app: FastAPI) -> Connection:
+    """Return the app's LDAP connection, creating (and binding) it on first use."""
+    async with app.state.ldap_lock:
+        if app.state.ldap is None:
+            app.state.ldap = await asyncio.to_thread(make_ldap_connection, settings)
+    return app.state.ldap
+
+async def get_ldap(request: Request) -> Connection:
+    try:
+        return await get_ldap_connection(request.app)
+    except LDAPException as err:
+        print(f"ERROR - LDAP not available: {err!r}")
+        raise HTTPException(status_code=503, detail="User directory not available")
+
+
+async def _poll_changes(app: FastAPI):
+    """Keep the cache up to date in the background so requests never wait for the wiki."""
+    while True:
+        try:
+            await update_cache_now(app.state.http)
+            app.state.cache_ready.set()
+        except Exception as err:
+            print(f"ERROR - cache update failed: {err!r}")
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+
+class _GZipOtherResponses(GZipMiddleware):
+    """GZipMiddleware for every response but /items, which keeps a compressed copy
+    of its cached body instead of compressing it on each request."""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/items":
+            await self.app(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
+
+app.add_middleware(_GZipOtherResponses, minimum_size=1024, compresslevel=5)
 
 last_checked_ts = None
-cache = {}
+last_full_refresh = 0 # time.monotonic(), same clock as TTLCache
+# uid → dataentry of existing item pages only; misses go to missing_pages, so
+# lookups of unknown ids cannot push real items out
+cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+# uids without a wiki page, so repeated lookups do not hit the wiki
+missing_pages = TTLCache(maxsize=MISSING_CACHE_SIZE, ttl=MISSING_CACHE_TTL)
+# serialized /items response as (body, etag, gzipped body), rebuilt lazily after
+# every change to the cache
+items_json = None
+# user_id → result of read_user_data
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
 class Item(BaseModel):
     uid : Optional[int]
@@ -61,20 +174,13 @@ DW_TO_I = {'ID': 'uid', # DW → item
            'Anmerkungen' : 'anmerkungen'
            }
 I_TO_DW = {value: key for key, value in DW_TO_I.items()}
+_DW_ITEMS = tuple(DW_TO_I.items())
+_ITEM_TO_DW = tuple(I_TO_DW.items())
 
 
 def _dw_to_item(dataentry : Dict[str, str]):
-    item_fields = {}
-    for k in dataentry.keys():
-        try:
-            target_field = DW_TO_I[k]
-            if dataentry[k] != "":
-                item_fields[target_field] = dataentry[k]
-            else: 
-                item_fields[target_field] = None
-
-        except KeyError:
-            pass
+    # empty strings become None
+    item_fields = {dst: dataentry[src] or None for src, dst in _DW_ITEMS if src in dataentry}
     # Special cases
     if 'typ' in item_fields.keys():
         if type(item_fields['typ']) is str:
@@ -90,142 +196,322 @@ def _dw_to_item(dataentry : Dict[str, str]):
     return item
 
 def _item_to_dw(item: Item):
-    dataentry = {}
-    for k in item.__fields__.keys():
-        try:
-            target_field = I_TO_DW[k]
-            dataentry[target_field] = item.__fields__[k]
-        except KeyError:
-            pass
-    return dataentry
-
-def get_dataentry(uid: int):
-    page = settings.wiki_path + f"{uid:03d}"
-    if dw.pages.info(page) == {}:
-        print(f"ERROR - {page} does not exist. Skipping it.")
+    values = item.__dict__ # field values; item.__fields__ only holds their definitions
+    return {dw: values[i] for i, dw in _ITEM_TO_DW if values.get(i) is not None}
+
+async def dw_send(wiki: httpx.AsyncClient, command: str, *args):
+    """Async counterpart of DokuWiki.send(): POST an XML-RPC *command* to the wiki
+    using the httpx session *wiki*."""
+    body = dumps(args, command, allow_none=True)
+    response = await wiki.post(XMLRPC_PATH, content=body, headers={"Content-Type": "text/xml"})
+    response.raise_for_status()
+    try:
+        # DokuWiki sometimes prepends a blank line to the XML declaration
+        return loads(response.content.lstrip())[0][0]
+    except Fault as err:
+        return _fault_result(err)
+
+def _fault_result(err: Fault):
+    if err.faultCode == 121:
+        return {}
+    elif err.faultCode == 321:
+        return []
+    raise DokuWikiError(err)
+
+async def dw_multicall(wiki: httpx.AsyncClient, *calls):
+    """Execute several (command, *args) tuples in a single system.multicall
+    round trip. Results are returned in order, faults mapped as in dw_send().
+    Other faults are returned as DokuWikiError instead of raised, so a single
+    failing call does not discard the results of the others."""
+    results = await dw_send(wiki, 'system.multicall',
+                            [{'methodName': command, 'params': list(args)} for command, *args in calls])
+    return [_multicall_result(r) for r in results]
+
+def _multicall_result(result):
+    if isinstance(result, list):
+        return result[0]
+    try:
+        return _fault_result(Fault(result['faultCode'], result['faultString']))
+    except DokuWikiError as err:
+        return err
+
+def _item_page(uid: int):
+    return settings.wiki_path + f"{uid:03d}"
+
+def _parse_dataentry(uid: int, content: str):
+    if not content: # wiki.getPage returns nothing for non-existent pages
+        print(f"ERROR - {_item_page(uid)} does not exist. Skipping it.")
+        missing_pages[uid] = True
         return {}
-    content = dw.pages.get(page)
-    data = Dataentry.get(content)
-    return data
-
-def update_cache(since_ts=None):
-    global cache
-    if not since_ts: # no cache, retrieve all
-        cache = {}
-        changed_item_pages = dw.pages.list(settings.wiki_path)
+    return Dataentry.get(content)
+
+async def get_dataentry(wiki: httpx.AsyncClient, uid: int):
+    if uid in missing_pages:
+        return {}
+    content = await dw_send(wiki, 'wiki.getPage', _item_page(uid))
+    return _parse_dataentry(uid, content)
+
+async def _shared_dataentries(uids, revs):
+    """Look up dataentries that any worker already stored in Redis. If the current
+    page revision of a uid is known (*revs*), only an entry for that revision is used."""
+    if app.state.redis is None or not uids:
+        return {}
+    try:
+        values = await app.state.redis.mget([f"item:{uid}" for uid in uids])
+    except redis.RedisError as err:
+        print(f"ERROR - Redis lookup failed: {err!r}")
+        return {}
+    dataentries = {}
+    for uid, value in zip(uids, values):
+        if value is None:
+            continue
+        rev, dataentry = orjson.loads(value)
+        if uid in revs and revs[uid] != rev:
+            continue # page changed since it was stored
+        dataentries[uid] = dataentry
+    return dataentries
+
+async def _share_dataentries(dataentries, revs):
+    if app.state.redis is None or not dataentries:
+        return
+    try:
+        async with app.state.redis.pipeline(transaction=False) as pipe:
+            for uid, dataentry in dataentries.items():
+                pipe.set(f"item:{uid}", orjson.dumps([revs.get(uid), dataentry]), ex=REDIS_TTL)
+            await pipe.execute()
+    except redis.RedisError as err:
+        print(f"ERROR - Redis update failed: {err!r}")
+
+async def fetch_dataentries(wiki: httpx.AsyncClient, uids, revs=None):
+    """Fetch the dataentries of all *uids*, from Redis if another worker already did,
+    otherwise from the wiki in system.multicall batches of MULTICALL_CHUNK pages (at
+    most FETCH_CONCURRENCY batches at a time). *revs* optionally maps uids to their
+    current page revision. Returns a dict uid → dataentry; failed fetches are logged
+    and left out."""
+    uids = list(uids)
+    revs = revs or {}
+    dataentries = await _shared_dataentries(uids, revs)
+    fetched = {uid: {} for uid in uids if uid not in dataentries and uid in missing_pages}
+    todo = [uid for uid in uids if uid not in dataentries and uid not in fetched]
+    sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async def _fetch(chunk):
+        async with sem:
+            return chunk, await dw_multicall(wiki, *[('wiki.getPage', _item_page(uid)) for uid in chunk])
+
+    chunks = [todo[i:i + MULTICALL_CHUNK] for i in range(0, len(todo), MULTICALL_CHUNK)]
+    results = await asyncio.gather(*[_fetch(chunk) for chunk in chunks], return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"ERROR - could not fetch items: {result!r}")
+            continue
+        for uid, content in zip(*result):
+            try:
+                if isinstance(content, Exception):
+                    raise content
+                fetched[uid] = _parse_dataentry(uid, content)
+            except DokuWikiError as err:
+                print(f"ERROR - could not fetch item {uid}: {err!r}")
+    await _share_dataentries(fetched, revs)
+    dataentries.update(fetched)
+    return dataentries
+
+def _store_dataentries(dataentries):
+    """Put fetched *dataentries* into the cache. Empty ones (pages that do not exist,
+    already remembered in missing_pages) are removed instead. The /items body is
+    only rebuilt if its content changed."""
+    global items_json
+    changed = False
+    for uid, dataentry in dataentries.items():
+        if dataentry:
+            changed = changed or cache.get(uid) != dataentry
+            cache[uid] = dataentry
+        elif cache.pop(uid, None) is not None:
+            changed = True
+    if changed:
+        items_json = None
+
+async def update_cache(wiki: httpx.AsyncClient, since_ts=None):
+    global last_full_refresh, items_json
+    # retrieve all if there is no cache or well before its oldest entries expire
+    full_refresh = not since_ts or time.monotonic() - last_full_refresh >= FULL_REFRESH_INTERVAL
+    if full_refresh:
+        last_full_refresh = time.monotonic()
+        changed_item_pages = await dw_send(wiki, 'dokuwiki.getPagelist', settings.wiki_path, {})
     else:
-        changed_pages = dw.pages.changes(last_checked_ts)
+        changed_pages = await dw_send(wiki, 'wiki.getRecentChanges', since_ts)
         changed_item_pages = []
         for page in changed_pages:
             print(page)
             if page['name'].startswith(settings.wiki_path): # yes, here it is 'name'
                 page['id'] = page['name']
+                page['rev'] = page['version']
                 changed_item_pages.append(page)
         print(f"Changed items since last check: {len(changed_item_pages)}")
+    revs = {} # uid → page revision
     for page in changed_item_pages:
         #print(page)
-        uid = page['id'].split(":")[-1]
-        try:
-            uid = int(uid)
-        except ValueError:
-            print(f"Not an item: {uid} - skipping")
+        m = _UID_RE.fullmatch(page['id'])
+        if not m:
+            print(f"Not an item: {page['id']} - skipping")
             continue # a page that is not an item
-        cache[uid] = get_dataentry(uid)
+        revs[int(m.group(1))] = page.get('rev')
+    for uid in revs: # these pages exist (now)
+        missing_pages.pop(uid, None)
+    dataentries = await fetch_dataentries(wiki, revs, revs)
+    if full_refresh:
+        # drop pages that are gone; items whose fetch failed keep their old entry
+        for uid in [uid for uid in list(cache) if uid not in revs]:
+            if cache.pop(uid, None) is not None:
+                items_json = None
+    _store_dataentries(dataentries)
     print(f"Cache: {len(cache)}")
     return int(datetime.now().timestamp()) # use local timestamps, not utc
 
 
 
-
-@app.on_event("startup")
-async def startup_event():
-    #update_cache_now() # not for now
-    pass
-
-
-
-
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
 # Debugging
 @app.get("/update_cache")
-def update_cache_now():
+async def update_cache_now(wiki: httpx.AsyncClient = Depends(get_wiki)):
     global last_checked_ts
-    last_checked_ts = update_cache(last_checked_ts)
+    last_checked_ts = await update_cache(wiki, last_checked_ts)
     return {"last checked": last_checked_ts, "cache size": len(cache)}
 
 @app.get("/purge_cache")
-def purge_cache():
+async def purge_cache(wiki: httpx.AsyncClient = Depends(get_wiki)):
     global last_checked_ts
-    last_checked_ts = update_cache()
+    last_checked_ts = await update_cache(wiki)
     return {"last checked": last_checked_ts, "cache size": len(cache)}
 
 
+LOCATIONS = ["Schwind/Rzayev (PT 3.0.30)", "Böhm/Böhm (PT 3.0.31)", "Brockelmann/Schmidt (PT 3.0.41)", "FIL Besprechungsraum (PT 3.0.28)", "FIL Besprechungsraum (Sideboard)", "FIL Besprechungsraum (Schrank)", "FIL Besprechungsraum (Tresor)", "FIL Usability-Labor (PT 3.0.26)", "FIL Usability-Labor (Laboratories Sideboard)", "FIL Usability-Labor (Extras Sideboard)", "FIL Werkstatt (PT 3.0.27)", "FIL Werkstatt (Schrank unten)", "FIL Werkstatt (Schrank oben)", "FIL Werkstatt (Sideboard)", "Bazo/Kocur (PT 3.0.32)", "TB-Besprechungsraum (TB 1.101)", "TB-Labor (TB VR4)", "TB-Studio (TB VR4)", "TB-Werkstatt (TB VR4)", "Wimmer (TB 1.102)", "Hahn (TB 1.103)", "Bockes (TB 1.104)", "Projekt (TB 1.105)", "Schwappach/Lohmüller (TB 1.106)", "Safe", "anderer Ort", "unbekannt"]
+STATUSES = ["defekt", "entliehen", "geblockt", "reserviert", "verbaut", "verfügbar", "verloren"]
+TYPES = ["Adapter", "Audio", "Beamer", "Display", "Diverse", "Eingabegerät", "Kabel", "Kamera", "Laptop", "PC", "Prototyping", "Sensor", "Smartphone", "Smartwatch", "Software", "Spielkonsole", "Stativ", "Tablet", "Werkzeug"]
+
+
+def _encode_json(data):
+    """Encode response *data*; returns (body, etag)."""
+    body = orjson.dumps(data)
+    # weak, because GZipMiddleware may change the bytes on the wire
+    return body, 'W/"' + hashlib.sha1(body).hexdigest() + '"'
+
+def _json_response(request: Request, body: bytes, etag: str, gzipped: Optional[bytes] = None):
+    """Answer with *body*, or with 304 if the client has it already. *gzipped* is a
+    precompressed copy of *body* that is sent to clients accepting gzip."""
+    # only ETags: a timestamp would differ between workers and not reflect wiki changes
+    headers = {"ETag": etag}
+    if gzipped is not None:
+        headers["Vary"] = "Accept-Encoding"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(gzipped, media_type="application/json", headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+_LOCATIONS_JSON = _encode_json(LOCATIONS)
+_STATUSES_JSON = _encode_json(STATUSES)
+_TYPES_JSON = _encode_json(TYPES)
+
 @app.get("/locations")
-def read_suggested_locations():
-    locations = ["Schwind/Rzayev (PT 3.0.30)", "Böhm/Böhm (PT 3.0.31)", "Brockelmann/Schmidt (PT 3.0.41)", "FIL Besprechungsraum (PT 3.0.28)", "FIL Besprechungsraum (Sideboard)", "FIL Besprechungsraum (Schrank)", "FIL Besprechungsraum (Tresor)", "FIL Usability-Labor (PT 3.0.26)", "FIL Usability-Labor (Laboratories Sideboard)", "FIL Usability-Labor (Extras Sideboard)", "FIL Werkstatt (PT 3.0.27)", "FIL Werkstatt (Schrank unten)", "FIL Werkstatt (Schrank oben)", "FIL Werkstatt (Sideboard)", "Bazo/Kocur (PT 3.0.32)", "TB-Besprechungsraum (TB 1.101)", "TB-Labor (TB VR4)", "TB-Studio (TB VR4)", "TB-Werkstatt (TB VR4)", "Wimmer (TB 1.102)", "Hahn (TB 1.103)", "Bockes (TB 1.104)", "Projekt (TB 1.105)", "Schwappach/Lohmüller (TB 1.106)", "Safe", "anderer Ort", "unbekannt"]
-    return locations
+async def read_suggested_locations(request: Request):
+    return _json_response(request, *_LOCATIONS_JSON)
 
 @app.get("/statuses")
-def read_accepted_statuses():
-    statuses = ["defekt", "entliehen", "geblockt", "reserviert", "verbaut", "verfügbar", "verloren"]
-    return statuses
+async def read_accepted_statuses(request: Request):
+    return _json_response(request, *_STATUSES_JSON)
 
 @app.get("/types")
-def read_accepted_types():
-    types = ["Adapter", "Audio", "Beamer", "Display", "Diverse", "Eingabegerät", "Kabel", "Kamera", "Laptop", "PC", "Prototyping", "Sensor", "Smartphone", "Smartwatch", "Software", "Spielkonsole", "Stativ", "Tablet", "Werkzeug"]
-    return types
+async def read_accepted_types(request: Request):
+    return _json_response(request, *_TYPES_JSON)
 
 
 @app.get("/items")
-def list_items(item_type = None, location = None, status = None):
-    global last_checked_ts
-    last_checked_ts = update_cache(last_checked_ts)
-    if cache:
-        return [_dw_to_item(cache[i]) for i in cache.keys() ]
-    else: #dead code
-        assert False
-        items = []
-        for item_id in range(600): # TODO
-            dataentry = get_dataentry(item_id)
-            item = _dw_to_item(dataentry)
-            items.append(item)
-        return items
+async def list_items(request: Request, item_type = None, location = None, status = None):
+    global items_json
+    # all requests share the poller's first cache fill instead of each starting one
+    try:
+        await asyncio.wait_for(request.app.state.cache_ready.wait(), FIRST_LOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Items are not available yet")
+    if items_json is None:
+        # sorted by uid, so every worker produces the same body and ETag
+        body, etag = _encode_json([_dw_to_item(dataentry).dict()
+                                   for _, dataentry in sorted(list(cache.items())) if dataentry])
+        items_json = body, etag, gzip.compress(body, compresslevel=5) # once per cache change
+    return _json_response(request, *items_json)
 
 @app.get("/items/{item_id}")
-def read_item(item_id: int, purge_cache: bool = False):
-    if purge_cache or (item_id not in cache.keys()):
-        dataentry = get_dataentry(item_id)
-        cache[item_id] = dataentry
-    else:
-        dataentry = cache[item_id]
+async def read_item(request: Request, item_id: int, purge_cache: bool = False,
+                    wiki: httpx.AsyncClient = Depends(get_wiki)):
+    if purge_cache:
+        missing_pages.pop(item_id, None) # the page may have been created since
+    dataentry = None if purge_cache else cache.get(item_id)
+    if dataentry is None:
+        dataentry = await get_dataentry(wiki, item_id)
+        _store_dataentries({item_id: dataentry})
     item = _dw_to_item(dataentry)
     print("item generated")
-    return item
+    return _json_response(request, *_encode_json(item.dict()))
+
+@app.post("/items:batch")
+async def batch_read(ids: conlist(int, max_items=MAX_BATCH_SIZE),
+                     wiki: httpx.AsyncClient = Depends(get_wiki)):
+    dataentries = {}
+    misses = []
+    for item_id in ids:
+        dataentry = cache.get(item_id)
+        if dataentry is None:
+            misses.append(item_id)
+        else:
+            dataentries[item_id] = dataentry
+    fetched = await fetch_dataentries(wiki, set(misses))
+    _store_dataentries(fetched)
+    dataentries.update(fetched)
+    # items that could not be fetched are left out
+    return [_dw_to_item(dataentries[item_id]) for item_id in ids if item_id in dataentries]
 
 
 @app.get("/users/{user_id}")
-def read_user_data(user_id: str):
-    global l
+async def read_user_data(user_id: str, l: Connection = Depends(get_ldap)):
+    user = user_cache.get(user_id)
+    if user is None:
+        # ldap3 blocks, so keep it off the event loop
+        user = await asyncio.to_thread(_ldap_user_data, l, user_id)
+        if user is not None: # do not remember timeouts
+            user_cache[user_id] = user
+    return user
+
+def _ldap_user_data(l: Connection, user_id: str):
     query = f"(&(cn={user_id})(objectClass=urrzUser))"
     try:
-        results = l.search_ext_s(settings.ldap_base_dn, settings.ldap_scope, query, timeout=5)
-    except ldap.TIMEOUT as err:
+        msg_id = l.search(settings.ldap_base_dn, query, search_scope=settings.ldap_scope,
+                          attributes=['fullName', 'mail', 'groupMembership'],
+                          size_limit=2, time_limit=5) # two are enough to detect ambiguous ids
+        response, _ = l.get_response(msg_id, timeout=5)
+    except LDAPResponseTimeoutError as err:
         return None
-    assert len(results) == 1
-    result = results[0][1]
+    results = [r for r in response if r['type'] == 'searchResEntry']
+    if not results:
+        raise HTTPException(status_code=404, detail=f"User {user_id} not found")
+    if len(results) > 1:
+        raise HTTPException(status_code=500, detail=f"User id {user_id} is not unique")
+    result = results[0]['attributes']
     print(result)
     groups = []
     for g in result['groupMembership']:
-        groups.append(g.decode('utf-8').replace("cn=", "").replace(",ou=", ".").replace(",o=", ".").replace(",c=", "."))
+        groups.append(g.replace("cn=", "").replace(",ou=", ".").replace(",o=", ".").replace(",c=", "."))
     allowed = ["read_item", "list_items"]
     if set(settings.groups_with_edit_rights).intersection(set(groups)):  # at least one group matches
         allowed.append("update_item")
     return {"user_id": user_id,
-            "name": result['fullName'][0].decode('utf-8'),
-            "e-mail": result['mail'][0].decode('utf-8'),
+            "name": result['fullName'][0],
+            "e-mail": result['mail'][0],
             "groups": groups,
             "allowed": allowed
             }